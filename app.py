@@ -1,19 +1,36 @@
+import hashlib
 import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 from flask import Flask, render_template, redirect, url_for, flash, session
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 from flask_wtf import FlaskForm
 from wtforms import StringField, PasswordField, SubmitField, SelectMultipleField, TextAreaField, widgets
 from wtforms.validators import DataRequired, Email, EqualTo, Length
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.security import check_password_hash
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerifyMismatchError
 from dotenv import load_dotenv
 from llm import generate_feedback
 
 import requests
+import numpy as np
 
 # Import and load spaCy
+# Only the static word vectors are used (Doc.vector averages them), so none of the
+# pipeline components are loaded; nlp is just the tokenizer plus the vector table
 import spacy
-nlp = spacy.load("en_core_web_md")
+nlp = spacy.load(
+    "en_core_web_md",
+    exclude=["tok2vec", "tagger", "parser", "senter", "attribute_ruler", "lemmatizer", "ner"],
+)
+# The vector table is never written after load, so gunicorn workers forked from a
+# preloaded master keep sharing its pages (the vocab's string store still grows per worker)
 
 
 # Load environment variables
@@ -27,6 +44,14 @@ db = SQLAlchemy(app)
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
 
+password_hasher = PasswordHasher(time_cost=2, memory_cost=65536, parallelism=2)
+
+QUESTIONS_PER_INTERVIEW = 1
+SUBJECT_CHOICES_TTL = 300  # seconds
+TEXT_VECTOR_CACHE_SIZE = 4096
+FEEDBACK_WAIT_TIMEOUT = 60  # seconds
+FEEDBACK_POLL_INTERVAL = 0.5  # seconds
+
 # Database Models
 
 class Attempt(db.Model):
@@ -36,8 +61,11 @@ class Attempt(db.Model):
     user_answer = db.Column(db.Text, nullable=False)
     similarity_score = db.Column(db.Float, nullable=True) 
     feedback = db.Column(db.Text, nullable=True) 
+    feedback_pending = db.Column(db.Boolean, nullable=False, default=False)
+    feedback_queued_at = db.Column(db.DateTime, nullable=True) # UTC
     interview = db.relationship('Interview', backref='attempts')
     question = db.relationship('Question', backref='attempts')
+    __table_args__ = (db.Index('ix_attempt_interview', 'interview_id'),)
 
 class Subject(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -49,10 +77,22 @@ class Question(db.Model):
     text = db.Column(db.Text, nullable=False)
     model_answer = db.Column(db.Text, nullable=True)
     subject_id = db.Column(db.Integer, db.ForeignKey('subject.id'), nullable=False)
+    model_answer_vector = db.Column(db.LargeBinary, nullable=True)
+    __table_args__ = (db.Index('ix_q_subject', 'subject_id'),)
+
+    def get_model_answer_vector(self):
+        # The model answer never changes, so vectorize it once and keep it in the DB.
+        # The stored vector is already normalized (see text_vector), so float16 keeps
+        # enough precision at half the size. Rows in any other format are recomputed.
+        stored_size = nlp.vocab.vectors_length * np.dtype(np.float16).itemsize
+        if self.model_answer_vector is None or len(self.model_answer_vector) != stored_size:
+            self.model_answer_vector = text_vector(self.model_answer).astype(np.float16).tobytes()
+        return np.frombuffer(self.model_answer_vector, dtype=np.float16).astype(np.float32)
 
 class Interview(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    question_ids = db.Column(db.JSON, nullable=True) # Question ids in the order they are asked
     user = db.relationship('User', backref='interviews')
 
 class User(UserMixin, db.Model):
@@ -61,10 +101,179 @@ class User(UserMixin, db.Model):
     password_hash = db.Column(db.String(200), nullable=False)
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = password_hasher.hash(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        # Hashes created before the switch to argon2 are werkzeug (scrypt/pbkdf2) hashes; upgrade them on login
+        if not self.password_hash.startswith('$argon2'):
+            if not check_password_hash(self.password_hash, password):
+                return False
+            self.set_password(password)
+            return True
+        try:
+            password_hasher.verify(self.password_hash, password)
+        except (VerifyMismatchError, InvalidHashError):
+            return False
+        if password_hasher.check_needs_rehash(self.password_hash):
+            self.set_password(password)
+        return True
+
+# Answers and model answers repeat across interviews, so their vectors are kept in a
+# process-level LRU cache. Entries are keyed by a digest of the text, so the cache holds
+# at most TEXT_VECTOR_CACHE_SIZE vectors however long the answers are.
+_text_vector_cache = OrderedDict()
+_text_vector_lock = threading.Lock()
+
+def _text_key(text):
+    return hashlib.blake2b(text.encode(), digest_size=16).digest()
+
+def text_vectors(texts):
+    # Duplicate texts are vectorized once, and cache misses go through nlp.pipe in one batch.
+    # Vectors are L2-normalized here, so cosine similarity is a plain dot product.
+    keys = [_text_key(text) for text in texts]
+    unique_texts = dict(zip(keys, texts))
+    vectors = {}
+    with _text_vector_lock:
+        for key in unique_texts:
+            if key in _text_vector_cache:
+                _text_vector_cache.move_to_end(key)
+                vectors[key] = _text_vector_cache[key]
+
+    missing_keys = [key for key in unique_texts if key not in vectors]
+    docs = nlp.pipe([unique_texts[key] for key in missing_keys], batch_size=32)
+    for key, doc in zip(missing_keys, docs):
+        vector = doc.vector.astype(np.float32)
+        norm = np.linalg.norm(vector)
+        if norm:
+            vector /= norm
+        vector.flags.writeable = False
+        vectors[key] = vector
+
+    with _text_vector_lock:
+        for key in missing_keys:
+            _text_vector_cache[key] = vectors[key]
+        while len(_text_vector_cache) > TEXT_VECTOR_CACHE_SIZE:
+            _text_vector_cache.popitem(last=False)
+    return [vectors[key] for key in keys]
+
+def text_vector(text):
+    return text_vectors([text])[0]
+
+def cosine_similarities(a, b):
+    # Row-wise cosine similarity of two (N, dim) arrays of unit (or zero) vectors
+    return np.einsum('ij,ij->i', a, b)
+
+NO_MODEL_ANSWER_FEEDBACK = "No model answer available to compare against."
+FEEDBACK_UNAVAILABLE = "Feedback could not be generated for this answer."
+
+def similarity_scores(attempts):
+    # Similarity (0-100) of each answer to its model answer, computed in one vectorized pass
+    scores = np.zeros(len(attempts))
+    indexes = [i for i, attempt in enumerate(attempts) if attempt.question.model_answer]
+    if indexes:
+        user_vectors = np.stack(text_vectors([attempts[i].user_answer for i in indexes]))
+        model_vectors = np.stack([attempts[i].question.get_model_answer_vector() for i in indexes])
+        similarities = cosine_similarities(user_vectors, model_vectors)
+        # float16 model vectors can push the cosine just past 1, so clip before scaling.
+        # Scale and round in float64 so the stored scores are clean two-decimal values
+        similarities = np.clip(similarities, -1.0, 1.0)
+        scores[indexes] = np.round(similarities.astype(np.float64) * 100, 2)
+    return scores.tolist()
+
+# Background Feedback
+# LLM feedback takes seconds, so it is generated off the request thread.
+# Futures are keyed by attempt id so the summary can wait for them.
+feedback_executor = ThreadPoolExecutor(max_workers=8)
+pending_feedback = {}
+
+def safe_generate_feedback(user_answer, model_answer):
+    # An LLM failure (timeout, 5xx, rate limit) must not break the summary page
+    try:
+        return generate_feedback(user_answer, model_answer)
+    except Exception:
+        app.logger.exception("Feedback generation failed")
+        return FEEDBACK_UNAVAILABLE
+
+def store_feedback(attempt_id, user_answer, model_answer):
+    feedback_text = safe_generate_feedback(user_answer, model_answer)
+    try:
+        with app.app_context():
+            # Only fill in feedback nobody else has written yet (e.g. a summary that gave up waiting)
+            db.session.execute(
+                db.update(Attempt)
+                .where(Attempt.id == attempt_id, Attempt.feedback_pending)
+                .values(feedback=feedback_text, feedback_pending=False)
+            )
+            db.session.commit()
+    except Exception:
+        # Logged here because, with several workers, nobody may ever read this future's result
+        app.logger.exception("Could not store feedback for attempt %s", attempt_id)
+    finally:
+        pending_feedback.pop(attempt_id, None)
+    return feedback_text
+
+def queue_feedback(attempt):
+    pending_feedback[attempt.id] = feedback_executor.submit(
+        store_feedback, attempt.id, attempt.user_answer, attempt.question.model_answer
+    )
+
+def utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+def collect_feedback(attempts):
+    futures = [pending_feedback.pop(attempt.id, None) for attempt in attempts]
+    feedback = [attempt.feedback for attempt in attempts]
+
+    # Jobs queued by another worker process are polled until that worker stores the feedback.
+    # Each job gets FEEDBACK_WAIT_TIMEOUT from when it was queued; older ones are treated as
+    # lost (e.g. on a restart) and regenerated straight away, storing the result on the row.
+    timeout = timedelta(seconds=FEEDBACK_WAIT_TIMEOUT)
+    waiting = {attempts[i].id: i for i, future in enumerate(futures) if future is None}
+    while waiting:
+        rows = db.session.execute(
+            db.select(Attempt.id, Attempt.feedback, Attempt.feedback_pending, Attempt.feedback_queued_at)
+            .where(Attempt.id.in_(waiting))
+        ).all()
+        now = utcnow()
+        for row in rows:
+            i = waiting[row.id]
+            if not row.feedback_pending:
+                feedback[i] = row.feedback
+            elif row.feedback_queued_at is None or now - row.feedback_queued_at >= timeout:
+                futures[i] = feedback_executor.submit(
+                    store_feedback, row.id, attempts[i].user_answer, attempts[i].question.model_answer
+                )
+            else:
+                continue
+            del waiting[row.id]
+        # Rows that have disappeared are not waited on
+        for attempt_id in waiting.keys() - {row.id for row in rows}:
+            del waiting[attempt_id]
+        if waiting:
+            time.sleep(FEEDBACK_POLL_INTERVAL)
+
+    # The LLM calls are I/O-bound, so all of them run concurrently before waiting on any
+    for i, future in enumerate(futures):
+        if future is None:
+            continue
+        try:
+            feedback[i] = future.result()
+        except Exception:
+            app.logger.exception("Feedback job for attempt %s failed", attempts[i].id)
+            feedback[i] = feedback[i] or FEEDBACK_UNAVAILABLE
+    return feedback
+
+# Subjects rarely change, so the dashboard choices are cached per process
+_subject_choices = {'expires_at': 0.0, 'choices': []}
+
+def get_subject_choices():
+    now = time.monotonic()
+    if now >= _subject_choices['expires_at']:
+        _subject_choices['choices'] = [(s.id, s.name) for s in Subject.query.all()]
+        # Don't hold on to an empty list, so newly seeded subjects show up right away
+        if _subject_choices['choices']:
+            _subject_choices['expires_at'] = now + SUBJECT_CHOICES_TTL
+    return _subject_choices['choices']
 
 @login_manager.user_loader
 def load_user(user_id):
@@ -117,6 +326,7 @@ def login():
     if form.validate_on_submit():
         user = User.query.filter_by(email=form.email.data).first()
         if user and user.check_password(form.password.data):
+            db.session.commit() # Persist the hash if check_password upgraded it
             login_user(user)
             return redirect(url_for('dashboard'))
         else:
@@ -132,35 +342,38 @@ def logout():
 @login_required
 def dashboard():
     form = TopicSelectionForm()
-    form.subjects.choices = [(s.id, s.name) for s in Subject.query.all()]
+    form.subjects.choices = get_subject_choices()
     if form.validate_on_submit():
         selected_subject_ids = form.subjects.data
-        new_interview = Interview(user_id=current_user.id)
-        db.session.add(new_interview)
-        db.session.commit()
-        questions = (
-            Question.query
-            .filter(Question.subject_id.in_(selected_subject_ids))
-            .order_by(db.func.random())
-            .limit(1)
-            .all()
-        )
-        if not questions:
+        # Sample ids in Python rather than sorting the whole question set by random()
+        question_ids = [
+            question_id for (question_id,) in
+            db.session.query(Question.id).filter(Question.subject_id.in_(selected_subject_ids))
+        ]
+        picked_ids = random.sample(question_ids, k=min(QUESTIONS_PER_INTERVIEW, len(question_ids)))
+        if not picked_ids:
             flash("No questions found for the selected subjects. Please try other subjects.")
             return redirect(url_for('dashboard'))
+        new_interview = Interview(user_id=current_user.id, question_ids=picked_ids)
+        db.session.add(new_interview)
+        db.session.commit()
+        # Only the interview id goes in the session cookie; the question list stays in the DB
         session['interview_id'] = new_interview.id
-        session['question_ids'] = [q.id for q in questions]
         return redirect(url_for('interview_question', question_index=0))
     return render_template('dashboard.html', title='Dashboard', form=form)
 
 @app.route('/interview/question/<int:question_index>', methods=['GET', 'POST'])
 @login_required
 def interview_question(question_index):
-    if 'question_ids' not in session:
+    interview = None
+    if 'interview_id' in session:
+        interview = Interview.query.filter_by(id=session['interview_id'], user_id=current_user.id).first()
+    # Interviews created before question ids were stored on the row have none
+    if interview is None or not interview.question_ids:
         flash('Interview session not found. Please start a new one.')
         return redirect(url_for('dashboard'))
 
-    question_ids = session['question_ids']
+    question_ids = interview.question_ids
     if question_index >= len(question_ids):
         return redirect(url_for('interview_summary'))
 
@@ -169,19 +382,24 @@ def interview_question(question_index):
     form = AnswerForm()
     if form.validate_on_submit():
         user_answer = form.answer.data
-        question = db.session.get(Question, question_id)
-        model_answer = question.model_answer or ""
-        feedback_text = generate_feedback(user_answer, model_answer)
         attempt = Attempt(
-            interview_id = session['interview_id'],
+            interview_id = interview.id,
             question_id = question_id,
             user_answer = user_answer,
-            feedback = feedback_text
+            question = question,
+            feedback_pending = bool(question.model_answer),
+            feedback_queued_at = utcnow() if question.model_answer else None
         )
+        # Score now so the summary page only has to read results back
+        attempt.similarity_score = similarity_scores([attempt])[0]
+        if not question.model_answer:
+            attempt.feedback = NO_MODEL_ANSWER_FEEDBACK
         db.session.add(attempt)
         db.session.commit()
+        if attempt.feedback_pending:
+            queue_feedback(attempt)
         next_question_index = question_index + 1
-        if next_question_index < len(session['question_ids']):
+        if next_question_index < len(question_ids):
             return redirect(url_for('interview_question', question_index = next_question_index))
         else:
             return redirect(url_for('interview_summary'))
@@ -193,30 +411,40 @@ def interview_question(question_index):
 @app.route('/interview/summary')
 @login_required
 def interview_summary():
-    interview_id = session.pop('interview_id', None)
-    session.pop('question_ids', None) # Clean up session
+    interview_id = session.pop('interview_id', None) # Clean up session
     
     if not interview_id:
         flash("Could not find an interview to summarize.")
         return redirect(url_for('dashboard'))
     
-    interview = Interview.query.get_or_404(interview_id)
+    interview_query = (
+        Interview.query
+        .options(db.joinedload(Interview.attempts).joinedload(Attempt.question))
+        .filter_by(id=interview_id)
+    )
+    interview = interview_query.first_or_404()
     
-    # Process each answer
-    for attempt in interview.attempts:
-        if attempt.question.model_answer:
-
-            feedback_text = generate_feedback(attempt.user_answer, attempt.question.model_answer)
-            doc_user = nlp(attempt.user_answer)
-            doc_model = nlp(attempt.question.model_answer)
-            attempt.similarity_score = round((doc_user.similarity(doc_model)) * 100, 2)
-            attempt.feedback = feedback_text
-
-        else:
-            attempt.similarity_score = 0
-            attempt.feedback = "No model answer available to compare against."
-
-    db.session.commit()
+    # Attempts are scored on submission; only wait for feedback still being generated
+    unfinished_attempts = [a for a in interview.attempts if a.similarity_score is None or a.feedback_pending]
+    if unfinished_attempts:
+        feedback = collect_feedback(unfinished_attempts)
+        # Only attempts saved before scoring moved to submission still need a score
+        unscored_attempts = [a for a in unfinished_attempts if a.similarity_score is None]
+        scores = dict(zip([a.id for a in unscored_attempts], similarity_scores(unscored_attempts)))
+        # Write all results back with a single bulk UPDATE by primary key
+        updates = [
+            {
+                'id': attempt.id,
+                'similarity_score': scores.get(attempt.id, attempt.similarity_score),
+                'feedback': feedback_text if attempt.question.model_answer else NO_MODEL_ANSWER_FEEDBACK,
+                'feedback_pending': False,
+            }
+            for attempt, feedback_text in zip(unfinished_attempts, feedback)
+        ]
+        db.session.execute(db.update(Attempt), updates)
+        db.session.commit()
+        # The commit expired everything; reload it in one query instead of lazily per attempt
+        interview = interview_query.populate_existing().one()
     
     return render_template('interview_summary.html', title='Interview Feedback', interview=interview)
 
@@ -0,0 +1,7 @@
+# Production server config: gunicorn app:app
+# The app (and the spaCy model) is loaded once in the master before forking, so
+# workers share the model's memory pages copy-on-write instead of each loading it.
+preload_app = True
+workers = 4
+worker_class = 'gthread'
+threads = 4
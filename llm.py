@@ -9,7 +9,13 @@ client = InferenceClient(
     api_key=api_key,
 )
 
+# Cap prompt and output size so generation time stays bounded
+MAX_ANSWER_CHARS = 1500
+MAX_FEEDBACK_TOKENS = 80
+
 def generate_feedback(user_answer: str, model_answer: str) -> str:
+    user_answer = user_answer[:MAX_ANSWER_CHARS]
+    model_answer = model_answer[:MAX_ANSWER_CHARS]
     prompt = f"""
 You are an instructor evaluating a student's answer against a model answer.
 
@@ -28,7 +34,7 @@ Your evaluation:
     completion = client.chat.completions.create(
         model="HuggingFaceTB/SmolLM3-3B",
         messages=[{"role": "user", "content": prompt}],
-        max_tokens=150,
+        max_tokens=MAX_FEEDBACK_TOKENS,
     )
 
     return completion.choices[0].message['content']
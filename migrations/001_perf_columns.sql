@@ -0,0 +1,16 @@
+-- Columns and indexes added by the performance work. db.create_all() only creates
+-- missing tables, so apply this once to databases created before it:
+--   psql "$DATABASE_URL" -f migrations/001_perf_columns.sql
+
+-- Cached model answer vector (float16 bytes), computed on first use
+ALTER TABLE question ADD COLUMN IF NOT EXISTS model_answer_vector BYTEA;
+
+-- Background feedback generation
+ALTER TABLE attempt ADD COLUMN IF NOT EXISTS feedback_pending BOOLEAN NOT NULL DEFAULT FALSE;
+ALTER TABLE attempt ADD COLUMN IF NOT EXISTS feedback_queued_at TIMESTAMP WITHOUT TIME ZONE;
+
+-- Question ids for an interview, stored server-side instead of in the session
+ALTER TABLE interview ADD COLUMN IF NOT EXISTS question_ids JSON;
+
+CREATE INDEX IF NOT EXISTS ix_attempt_interview ON attempt (interview_id);
+CREATE INDEX IF NOT EXISTS ix_q_subject ON question (subject_id);